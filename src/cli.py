@@ -0,0 +1,99 @@
+import argparse
+import logging
+import os.path
+import sys
+import configuration
+import client
+
+def configure_logger():
+    logging.basicConfig(level = logging.INFO, format = "%(levelname)-8s %(message)s")
+
+def handle_serve(args):
+    import service
+    service.serve(args.host, args.port, args.workers or service.DEFAULT_MAX_WORKERS)
+
+def handle_plan(args):
+    source_file = os.path.abspath(args.source)
+    destination_file = os.path.abspath(args.destination)
+
+    service_client = client.ServiceClient(args.url)
+
+    # Use the planning service if it is running, otherwise plan in this process.
+    if service_client.is_available():
+        job = service_client.submit({}, source_file, destination_file)
+        job = service_client.wait(job["id"])
+
+        if job["status"] == "failed":
+            logging.error(job["error"])
+            return 1
+
+        found = job["status"] == "done"
+    else:
+        import planner
+        config = configuration.load_config()
+        configuration.validate_config(config)
+        found = planner.plan(config, source_file, destination_file) is not None
+
+    if not found:
+        logging.error("No solution could be found. Please adjust time windows.")
+        return 1
+
+    logging.info("The solution has been written to '{0}'.".format(destination_file))
+    return 0
+
+def handle_evaluate(args):
+    import planner
+    config = configuration.load_config()
+    configuration.validate_config(config)
+
+    metrics = planner.evaluate_routes(config, os.path.abspath(args.source), os.path.abspath(args.routes))
+
+    return 1 if metrics.violations > 0 or metrics.dropped > 0 else 0
+
+def handle_replay(args):
+    import planner
+
+    time_limit_ms = args.time_limit * 1000 if args.time_limit else planner.TIME_LIMIT_SOLUTION_MS
+    found = planner.plan_from_snapshot(os.path.abspath(args.snapshot), os.path.abspath(args.destination), time_limit_ms) is not None
+
+    if not found:
+        logging.error("No solution could be found. Please adjust time windows.")
+        return 1
+
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description = "Vehicle routing planner for timed deliveries.")
+    subparsers = parser.add_subparsers(dest = "command")
+    subparsers.required = True
+
+    serve_parser = subparsers.add_parser("serve", help = "Run the local planning service.")
+    serve_parser.add_argument("--host", default = client.DEFAULT_HOST)
+    serve_parser.add_argument("--port", type = int, default = client.DEFAULT_PORT)
+    serve_parser.add_argument("--workers", type = int, default = None, help = "Maximum number of jobs (and solver processes) that run at the same time.")
+    serve_parser.set_defaults(handler = handle_serve)
+
+    plan_parser = subparsers.add_parser("plan", help = "Plan the locations in an excel file.")
+    plan_parser.add_argument("source")
+    plan_parser.add_argument("destination")
+    plan_parser.add_argument("--url", default = client.DEFAULT_URL, help = "URL of the planning service.")
+    plan_parser.set_defaults(handler = handle_plan)
+
+    evaluate_parser = subparsers.add_parser("evaluate", help = "Validate and calculate the KPIs of the (edited) routes in an output file.")
+    evaluate_parser.add_argument("source")
+    evaluate_parser.add_argument("routes")
+    evaluate_parser.set_defaults(handler = handle_evaluate)
+
+    replay_parser = subparsers.add_parser("replay", help = "Solve a snapshot of a previous run again, without any API calls.")
+    replay_parser.add_argument("snapshot")
+    replay_parser.add_argument("destination")
+    replay_parser.add_argument("--time-limit", type = int, default = None, help = "Time limit of the search in seconds.")
+    replay_parser.set_defaults(handler = handle_replay)
+
+    args = parser.parse_args()
+
+    configure_logger()
+    return args.handler(args) or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
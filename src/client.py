@@ -0,0 +1,63 @@
+import urllib.request
+import urllib.error
+import json
+import logging
+import time
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_URL = "http://{0}:{1}".format(DEFAULT_HOST, DEFAULT_PORT)
+POLL_INTERVAL_SECONDS = 1
+
+logger = logging.getLogger()
+
+# Client for the local planning service (see service.py).
+class ServiceClient(object):
+    def __init__(self, url = DEFAULT_URL):
+        self.url = url.rstrip("/")
+
+    def is_available(self):
+        try:
+            self.get_jobs()
+            return True
+        except (urllib.error.URLError, OSError):
+            return False
+
+    def get_jobs(self):
+        return self.__request("GET", "/jobs")
+
+    def get_job(self, job_id):
+        return self.__request("GET", "/jobs/" + job_id)
+
+    def submit(self, configuration, source_file, destination_file):
+        return self.__request("POST", "/jobs", {
+            "configuration": configuration,
+            "source_file": source_file,
+            "destination_file": destination_file
+        })
+
+    # Waits for the job to finish. The log of the job is forwarded to the local logger.
+    def wait(self, job_id):
+        log_count = 0
+
+        while True:
+            job = self.get_job(job_id)
+
+            for level, message in job["log"][log_count:]:
+                logger.log(logging.getLevelName(level), message)
+            log_count = len(job["log"])
+
+            if job["status"] not in ("queued", "running"): return job
+
+            time.sleep(POLL_INTERVAL_SECONDS)
+
+    def __request(self, method, path, value = None):
+        data = json.dumps(value).encode("utf-8") if value is not None else None
+        request = urllib.request.Request(self.url + path, data = data, method = method, headers = { "Content-Type": "application/json" })
+
+        try:
+            with urllib.request.urlopen(request, timeout = 5) as response:
+                return json.loads(response.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            # The service reports validation errors as JSON
+            raise ValueError(json.loads(e.read().decode("utf-8"))["error"])
@@ -1,10 +1,10 @@
 from configparser import ConfigParser
 import os.path
-from datetime import time
-import dateutil.parser
+import datahelpers
 
 CONFIG_FILE = "config.ini"
 OPTIONS_SECTION = "options"
+REQUIRED_OPTIONS = ["default_country", "google_api_key", "bing_api_key", "service_time", "start_address"]
 
 def load_config():
     result = {}
@@ -23,12 +23,28 @@ def load_config():
     return dct
 
 def validate_config(value):
+    for option in REQUIRED_OPTIONS:
+        if not str(value.get(option, "")).strip(): raise ValueError("The option '{0}' is not configured.".format(option))
+
     # service_time must be an integer
     try:
         int(value["service_time"])
     except ValueError :
         raise ValueError("Service time must be a valid whole number representing the amount of minutes it takes to perform service at 1 location.")
 
+    # traffic_slices is optional, but must be a list of times
+    try:
+        datahelpers.get_time_slices(value.get("traffic_slices", ""))
+    except ValueError:
+        raise ValueError("Traffic slices must be a comma separated list of departure times (e.g. 7:00, 9:00, 16:00).")
+
+    # The daily quotas are optional, but must be whole numbers
+    for option in ("google_daily_quota", "bing_daily_quota"):
+        try:
+            if str(value.get(option, "")).strip(): int(value[option])
+        except ValueError:
+            raise ValueError("The daily quotas must be whole numbers.")
+
 def save_config(value):
     validate_config(value)
 
@@ -1,9 +1,11 @@
-import dateutil.parser
-import datetime
 import collections
+import re
 import utils
 
 TimeWindow = collections.namedtuple("TimeWindow", ["start", "end"])
+AddressSignature = collections.namedtuple("AddressSignature", ["postal_code", "house_number", "box", "street"])
+
+FIRST_DATA_ROW = 2 # The first row of the excel sheet contains the headers
 
 def get_address_from_entry(entry, default_country):
     result = ""
@@ -29,3 +31,179 @@ def get_time_window_from_entry(entry):
     return TimeWindow(
         utils.time_to_seconds(utils.parse_time(start_time)), 
         utils.time_to_seconds(utils.parse_time(end_time)))
+
+def get_time_slices(value):
+    # Comma separated list of departure times, e.g. "7:00, 9:00, 16:00"
+    if not value or not value.strip(): return []
+
+    return sorted(utils.time_to_seconds(utils.parse_time(part.strip())) for part in value.split(","))
+
+def is_empty(value):
+    # Empty cells are read as "None"
+    return value is None or str(value).strip() in ("", "None")
+
+def get_time_windows_from_entry(entry):
+    result = [get_time_window_from_entry(entry)]
+
+    # Additional windows are specified in "Start Time 2"/"End Time 2", "Start Time 3"/"End Time 3", ...
+    number = 2
+    while "start time {0}".format(number) in entry or "end time {0}".format(number) in entry:
+        start_time = entry.get("start time {0}".format(number))
+        end_time = entry.get("end time {0}".format(number))
+
+        if is_empty(start_time) != is_empty(end_time):
+            raise ValueError("Start time {0} and end time {0} must both be specified.".format(number))
+
+        if not is_empty(start_time):
+            result.append(TimeWindow(
+                utils.time_to_seconds(utils.parse_time(start_time)),
+                utils.time_to_seconds(utils.parse_time(end_time))))
+
+        number = number + 1
+
+    result.sort()
+
+    for window in result:
+        if window.start >= window.end: raise ValueError("start time must be before end time.")
+
+    for previous, current in zip(result, result[1:]):
+        if current.start <= previous.end: raise ValueError("time windows overlap.")
+
+    return result
+
+def get_service_time_from_entry(entry, default_service_time):
+    # The service time is specified in minutes. The result is in seconds.
+    if "service time" not in entry or is_empty(entry["service time"]): return default_service_time
+
+    # Fractions of minutes are rejected rather than silently truncated. Excel cells may contain whole numbers as floats (e.g. 5.0).
+    try:
+        minutes = float(entry["service time"])
+    except ValueError:
+        raise ValueError("service time must be a whole number of minutes.")
+
+    if not minutes.is_integer(): raise ValueError("service time must be a whole number of minutes.")
+
+    minutes = int(minutes)
+
+    if minutes < 0: raise ValueError("service time cannot be negative.")
+
+    return minutes * 60
+
+def get_drop_penalty_from_entry(entry):
+    # Locations without a drop penalty are mandatory.
+    if "drop penalty" not in entry or is_empty(entry["drop penalty"]): return None
+
+    try:
+        penalty = int(float(entry["drop penalty"]))
+    except (ValueError, OverflowError):
+        raise ValueError("drop penalty must be a whole number.")
+
+    if penalty < 0: raise ValueError("drop penalty cannot be negative.")
+
+    return penalty
+
+def get_pickup_from_entry(entry, index, num_entries):
+    # The pickup is the row number of the pickup location in the excel sheet. The result is the index of the entry.
+    if "pickup row" not in entry or is_empty(entry["pickup row"]): return None
+
+    try:
+        pickup = int(float(entry["pickup row"])) - FIRST_DATA_ROW
+    except (ValueError, OverflowError):
+        raise ValueError("pickup row must be a row number.")
+
+    if pickup < 0 or pickup >= num_entries: raise ValueError("pickup row does not exist.")
+    if pickup == index: raise ValueError("a location cannot be its own pickup.")
+
+    return pickup
+
+def _parse_entries(entries, parse, description):
+    result = []
+    errors = []
+
+    # Parse and validate every entry, so all problems can be reported at once.
+    for i, entry in enumerate(entries):
+        try:
+            result.append(parse(i, entry))
+        except ValueError as e:
+            errors.append("Row {0}: {1}".format(i + FIRST_DATA_ROW, e))
+
+    if errors:
+        raise ValueError("Invalid {0}:\n".format(description) + "\n".join(errors))
+
+    return result
+
+def get_time_windows_from_entries(entries):
+    return _parse_entries(entries, lambda i, entry: get_time_windows_from_entry(entry), "time windows")
+
+def get_service_times_from_entries(entries, default_service_time):
+    return _parse_entries(entries, lambda i, entry: get_service_time_from_entry(entry, default_service_time), "service times")
+
+def get_drop_penalties_from_entries(entries):
+    return _parse_entries(entries, lambda i, entry: get_drop_penalty_from_entry(entry), "drop penalties")
+
+def get_pickup_deliveries_from_entries(entries):
+    pickups = _parse_entries(entries, lambda i, entry: get_pickup_from_entry(entry, i, len(entries)), "pickup rows")
+
+    # Returns (pickup, delivery) pairs of entry indices
+    return [(pickup, delivery) for delivery, pickup in enumerate(pickups) if pickup is not None]
+
+# Abbreviations are expanded, so different spellings of the same address share a cache entry.
+ADDRESS_ABBREVIATIONS = {
+    "st": "street",
+    "str": "straat",
+    "rd": "road",
+    "ave": "avenue",
+    "av": "avenue",
+    "blvd": "boulevard",
+    "ln": "lane",
+    "dr": "drive",
+    "sq": "square",
+    "stwg": "steenweg",
+    "stw": "steenweg"
+}
+
+ADDRESS_SEPARATOR_PATTERN = re.compile(r"[\s,;]+")
+ADDRESS_PUNCTUATION_PATTERN = re.compile(r"[.'\"]")
+POSTAL_CODE_PATTERN = re.compile(r"\b(\d{4})\s+([a-z]{2})\b") # e.g. "1234 AB" -> "1234ab"
+NUMBER_PATTERN = re.compile(r"^\d+[a-z]?$")
+FULL_POSTAL_CODE_PATTERN = re.compile(r"^\d{4}[a-z]{2}$") # Only a full Dutch-style postal code identifies a street
+BOX_KEYWORDS = ["bus", "box", "bte"] # e.g. "Kerkstraat 12 bus 3"
+
+def normalize_address(address):
+    result = address.lower()
+    result = ADDRESS_PUNCTUATION_PATTERN.sub(" ", result)
+    result = POSTAL_CODE_PATTERN.sub(r"\1\2", result)
+
+    tokens = [ADDRESS_ABBREVIATIONS.get(token, token) for token in ADDRESS_SEPARATOR_PATTERN.split(result) if token]
+
+    return " ".join(tokens)
+
+def get_address_signature(normalized_address):
+    # Addresses are built as "<street> <house number> <postal code> <city> <country>", so the
+    # postal code is the last token starting with a digit and the house number the one before it.
+    # Only addresses with a full postal code get a signature, since shorter postal codes cover
+    # a whole municipality in which the same street name and house number can occur more than once.
+    tokens = normalized_address.split()
+    numbers = [i for i, token in enumerate(tokens) if token[0].isdigit()]
+
+    if len(numbers) < 2: return None
+
+    postal_code_idx = numbers[-1]
+    house_number_idx = numbers[-2]
+    box = None
+
+    if not FULL_POSTAL_CODE_PATTERN.match(tokens[postal_code_idx]): return None
+
+    # The box number follows the house number, e.g. "12 bus 3"
+    if house_number_idx > 0 and tokens[house_number_idx - 1] in BOX_KEYWORDS:
+        if len(numbers) < 3 or numbers[-3] != house_number_idx - 2: return None
+
+        box = tokens[house_number_idx]
+        house_number_idx = numbers[-3]
+
+    if not NUMBER_PATTERN.match(tokens[house_number_idx]): return None
+
+    street = " ".join(tokens[:house_number_idx])
+    if not street: return None
+
+    return AddressSignature(tokens[postal_code_idx], tokens[house_number_idx], box, street)
@@ -0,0 +1,120 @@
+import collections
+from solution import Node, Vehicle, Solution
+
+SECONDS_PER_KM = 52.4 # Assumes an average speed of 70 kph
+VEHICLE_COST = 100000 # Additional cost for every vehicle after the first one
+SPAN_COST_COEFFICIENT = 2 # Cost per second of the total time of a vehicle. This should minimize "idle" time of vehicles.
+MANDATORY_DROP_PENALTY = 10 ** 12 # Penalty for not visiting a mandatory location. High enough to only drop it if it can't be visited.
+
+# A leg ends at a node. The first node of a route has no leg.
+Leg = collections.namedtuple("Leg", ["distance", "travel_time", "departure_time"])
+RouteMetrics = collections.namedtuple("RouteMetrics", ["legs", "departure_time", "distance", "travel_time", "service_time", "idle_time", "total_time", "violations", "violation_time", "cost"])
+SolutionMetrics = collections.namedtuple("SolutionMetrics", ["routes", "vehicles", "distance", "travel_time", "service_time", "idle_time", "total_time", "violations", "violation_time", "dropped", "cost"])
+
+def arc_cost(distance_m, time):
+    # Same cost as used by the solver for an arc. The time includes the service time at the origin.
+    return int((SECONDS_PER_KM * distance_m * time) / 1000)
+
+def get_window_violation(time, windows):
+    # Returns the amount of seconds the time is outside of the nearest window, 0 if it's within one of the windows.
+    return min(max(start - time, time - end, 0) for start, end in windows)
+
+def get_drop_penalty(penalty):
+    # Locations without a drop penalty are mandatory.
+    return penalty if penalty is not None else MANDATORY_DROP_PENALTY
+
+# Computes the KPIs of a solution. time_windows, service_times and drop_penalties contain a value for every location, including the start location (index 0).
+# The cost is the objective of the solver: the arc costs, the span cost and vehicle cost of the routes and the penalties of the dropped locations.
+def evaluate(solution, matrix, time_windows, service_times, drop_penalties):
+    routes = [_evaluate_route(vehicle, matrix, time_windows, service_times) for vehicle in solution.vehicles]
+
+    vehicles = len(routes)
+    cost = sum(route.cost for route in routes) + VEHICLE_COST * max(vehicles - 1, 0)
+    cost = cost + sum(get_drop_penalty(drop_penalties[location]) for location in solution.dropped)
+
+    return SolutionMetrics(
+        routes,
+        vehicles,
+        sum(route.distance for route in routes),
+        sum(route.travel_time for route in routes),
+        sum(route.service_time for route in routes),
+        sum(route.idle_time for route in routes),
+        sum(route.total_time for route in routes),
+        sum(route.violations for route in routes),
+        sum(route.violation_time for route in routes),
+        len(solution.dropped),
+        cost)
+
+def _evaluate_route(vehicle, matrix, time_windows, service_times):
+    nodes = vehicle.nodes
+    legs = [None]
+
+    # The departure from the start location is right before the first stop (same as the solver).
+    for previous, node in zip(nodes, nodes[1:]):
+        departure_time = node.time if previous is nodes[0] else previous.time + service_times[previous.index]
+
+        entry = matrix.get_entry(previous.index, node.index, departure_time)
+        if entry is None: raise ValueError("Unable to find distance/time between addresses.")
+
+        legs.append(Leg(entry.distance, entry.time, departure_time))
+
+    stops = nodes[1:-1]
+    departure_time = nodes[1].time - legs[1].travel_time
+
+    distance = sum(leg.distance for leg in legs[1:])
+    travel_time = sum(leg.travel_time for leg in legs[1:])
+    service_time = sum(service_times[node.index] for node in stops)
+    total_time = nodes[-1].time - departure_time
+    idle_time = total_time - travel_time - service_time
+
+    violation_times = [get_window_violation(node.time, time_windows[node.index]) for node in stops]
+    violations = sum(1 for violation_time in violation_times if violation_time > 0)
+
+    # The service time at the origin is part of the time of an arc. The first arc leaves the start location.
+    cost = sum(arc_cost(int(leg.distance * 1000), leg.travel_time + service_times[previous.index]) for previous, leg in zip(nodes, legs[1:]))
+    # The solver fixes the start of the time dimension to zero, so the span of a route is the time it ends.
+    cost = cost + SPAN_COST_COEFFICIENT * nodes[-1].time
+
+    return RouteMetrics(legs, departure_time, distance, travel_time, service_time, idle_time, total_time, violations, sum(violation_times), cost)
+
+# Recalculates the arrival times of routes, e.g. after they have been edited manually. Routes contain stop ids, excluding the start location (0).
+# Vehicles leave the start location so they arrive at the start of the first window of their first stop and wait when they arrive early.
+def simulate(routes, matrix, time_windows, service_times):
+    vehicles = []
+    visited = set()
+
+    for route in routes:
+        if not route: continue
+
+        first = route[0]
+        entry = matrix.get_entry(0, first, time_windows[first][0][0])
+        if entry is None: raise ValueError("Unable to find distance/time between addresses.")
+
+        departure_time = time_windows[first][0][0] - entry.time
+        nodes = [Node(0, 0)]
+        previous = 0
+
+        for index in route:
+            entry = matrix.get_entry(previous, index, departure_time)
+            if entry is None: raise ValueError("Unable to find distance/time between addresses.")
+
+            arrival_time = departure_time + entry.time
+
+            # Wait for the next window to open
+            opening_times = [start for start, end in time_windows[index] if end >= arrival_time]
+            if opening_times: arrival_time = max(arrival_time, min(opening_times))
+
+            nodes.append(Node(index, arrival_time))
+            departure_time = arrival_time + service_times[index]
+            previous = index
+            visited.add(index)
+
+        entry = matrix.get_entry(previous, 0, departure_time)
+        if entry is None: raise ValueError("Unable to find distance/time between addresses.")
+
+        nodes.append(Node(0, departure_time + entry.time))
+        vehicles.append(Vehicle(nodes))
+
+    dropped = [index for index in range(1, len(time_windows)) if index not in visited]
+
+    return Solution(vehicles, dropped)
@@ -1,6 +1,8 @@
 import openpyxl
 import datetime
 
+SUMMARY_SHEET = "Summary"
+
 class RecordSet(object):
     def __init__(self, columns, entries):
         self.columns = columns
@@ -23,7 +25,10 @@ def read_locations(path):
             if index < len(columns):
                 column = columns[index]
 
-            entry[column.lower()] = str(cell.value).split("|")[0] # Values can contains | characters. If they do, we only want to take the first part of the value.
+            if isinstance(cell.value, (datetime.time, datetime.datetime)):
+                entry[column.lower()] = cell.value # Keep native time cells, so they don't have to be parsed again.
+            else:
+                entry[column.lower()] = str(cell.value).split("|")[0] # Values can contains | characters. If they do, we only want to take the first part of the value.
 
         # Validate entry
         if "address" not in entry:
@@ -39,10 +44,13 @@ def read_locations(path):
 
     return RecordSet(columns, entries)
 
-def write_solution(solution, locations, images, record_set, service_time, matrix, path):
+# metrics are the KPIs of the solution (see evaluation.evaluate). images can be None when solving offline. service_times contains the service time in seconds for every location, including the start location.
+def write_solution(solution, metrics, images, record_set, service_times, path):
     wb = openpyxl.Workbook()
 
     for i, vehicle in enumerate(solution.vehicles):
+        route = metrics.routes[i]
+
         # Create a sheet for the vehicle
         if i == 0:
             ws = wb.active
@@ -56,36 +64,85 @@ def write_solution(solution, locations, images, record_set, service_time, matrix
         # Append nodes to the worksheet
         for j, node in enumerate(vehicle.nodes):
             if j == 0:  # The first node is the depot. Departure time = Arrival time of next - travel time 
-                next_time = vehicle.nodes[1].time
-                dist_time = matrix.get_entry(node.location, vehicle.nodes[1].location)
-                seconds = next_time - dist_time.time
-                departure_time = str(datetime.timedelta(seconds = seconds))
+                departure_time = str(datetime.timedelta(seconds = route.departure_time))
                 ws.append(([""] * (len(record_set.columns) + 1)) + [departure_time]) # Empty columns for everything except departure time
             else:
                 td = datetime.timedelta(seconds = node.time)
                 arrival_time = str(td)
-                departure_td = td + datetime.timedelta(minutes = service_time)
+                departure_td = td + datetime.timedelta(seconds = service_times[node.index])
                 departure_time = str(departure_td)
 
-                prev_location = vehicle.nodes[j - 1].location
-                dist_time = matrix.get_entry(prev_location, node.location)
-                distance = round(dist_time.distance, 1)
+                leg = route.legs[j]
+                distance = round(leg.distance, 1)
 
-                travel_time = str(datetime.timedelta(seconds = dist_time.time))
+                travel_time = str(datetime.timedelta(seconds = leg.travel_time))
 
                 if j == len(vehicle.nodes) - 1: # Arrival at the depot
                     arrival_time = str(datetime.timedelta(seconds = node.time))
                     ws.append(([""] * (len(record_set.columns))) + [arrival_time, "", travel_time, distance])
                 else:
-                    loc_idx = locations.index(node.location)
-                    entry = record_set.entries[loc_idx - 1]
+                    entry = record_set.entries[node.index - 1]
                     row = [entry[k.lower()] or "" for k in record_set.columns]
                     ws.append(row + [ arrival_time, departure_time, travel_time, distance ])
 
         # Add the map image
-        image_index = len(vehicle.nodes) + 1 + 2 # 1 for the headers, 2 as empty space
+        if images:
+            image_index = len(vehicle.nodes) + 1 + 2 # 1 for the headers, 2 as empty space
+
+            img = openpyxl.drawing.image.Image(images[i])
+            ws.add_image(img, "A" + str(image_index))
+
+    # Add the locations that couldn't be planned
+    if solution.dropped:
+        ws = wb.create_sheet(title = "Unplanned")
+        ws.append(record_set.columns)
+
+        for location in solution.dropped:
+            entry = record_set.entries[location - 1]
+            ws.append([entry[k.lower()] or "" for k in record_set.columns])
+
+    # Add the KPIs of the solution
+    ws = wb.create_sheet(title = SUMMARY_SHEET)
+    ws.append([ "Vehicle", "Distance", "Travel Time", "Service Time", "Idle Time", "Total Time", "Window Violations" ])
+
+    for i, route in enumerate(metrics.routes):
+        ws.append([ i + 1, round(route.distance, 1) ] + [ str(datetime.timedelta(seconds = value)) for value in (route.travel_time, route.service_time, route.idle_time, route.total_time) ] + [ route.violations ])
+
+    ws.append([ "Total", round(metrics.distance, 1) ] + [ str(datetime.timedelta(seconds = value)) for value in (metrics.travel_time, metrics.service_time, metrics.idle_time, metrics.total_time) ] + [ metrics.violations ])
+
+    wb.save(filename = path)
+
+# Reads the routes from a (manually edited) output file. The rows are matched to the entries of the record set on their values.
+# Returns a list of routes per vehicle, containing location indices (1 is the first entry).
+def read_routes(path, record_set):
+    wb = openpyxl.load_workbook(filename = path)
+
+    indices = {}
+    for i, entry in enumerate(record_set.entries):
+        indices.setdefault(_get_row_key([entry[k.lower()] for k in record_set.columns]), []).append(i + 1)
+
+    routes = []
+
+    for ws in wb.worksheets:
+        if not ws.title.startswith("Vehicle "): continue
+
+        route = []
+
+        for i, row in enumerate(ws.rows):
+            if i == 0: continue     # the first row contains the headers
+
+            values = [ cell.value for cell in row[:len(record_set.columns)] ]
+            if all(value is None or value == "" for value in values): continue  # Start/end location or empty row
+
+            candidates = indices.get(_get_row_key(values))
+            if not candidates:
+                raise ValueError("Unable to find row {0} of sheet '{1}' in the source file.".format(i + 1, ws.title))
+
+            route.append(candidates.pop(0))
+
+        routes.append(route)
 
-        img = openpyxl.drawing.image.Image(images[i])
-        ws.add_image(img, "A" + str(image_index))
+    return routes
 
-    wb.save(filename = path)
\ No newline at end of file
+def _get_row_key(values):
+    return tuple("" if value is None or value == "None" else str(value).split("|")[0] for value in values)
@@ -1,87 +1,319 @@
 import googlemaps
 import logging
 import collections
-import utils
 import requests
 import json
 import pickle
 import os.path
 import shutil
 import tempfile
+import datetime
+import bisect
+import threading
+import array
+import datahelpers
+import requestscheduler
+import re
 
 logger = logging.getLogger()
 
+MATRIX_BATCH_SIZE = 20 # Maximum number of origins/destinations per distance matrix request
+MISSING_TIME = -1 # Marks entries of a distance/time matrix that are unknown
+COORDINATE_PATTERN = re.compile(r"LatLng\(latitude=([^,]+), longitude=([^)]+)\)") # Coordinates in the keys of older matrix caches
+BATCH_KEY_SEPARATOR = re.compile(r"(?<=\))-(?=LatLng)")
+
 LatLng = collections.namedtuple("LatLng", ["latitude", "longitude"])
 DistTime = collections.namedtuple("DistTime", ["distance", "time"])
 
-class DistanceTimeMatrix(object):
-    def __init__(self, row_keys, col_keys):
-        self.__row_keys = row_keys
-        self.__col_keys = col_keys
-        self.__matrix = [ [ None for i in range(len(row_keys)) ] for j in range(len(col_keys)) ]
+# Coordinates of the locations, stored in arrays. The index of a location is its stop id.
+class Locations(object):
+    def __init__(self, coordinates = ()):
+        self.__latitudes = array.array("d")
+        self.__longitudes = array.array("d")
+
+        for coordinate in coordinates:
+            self.append(coordinate)
+
+    def append(self, coordinate):
+        self.__latitudes.append(coordinate.latitude)
+        self.__longitudes.append(coordinate.longitude)
+
+        return len(self.__latitudes) - 1
 
-    def add_matrix(self, row_keys, col_keys, matrix):
-        for row_idx, row in enumerate(matrix):
-            for col_idx, value in enumerate(row):
-                row_key = row_keys[row_idx]
-                col_key = col_keys[col_idx]
+    def __len__(self):
+        return len(self.__latitudes)
 
-                if row_key not in self.__row_keys:
-                    raise ValueError("Invalid row key '{0}'.".format(row_key))
+    def __getitem__(self, stop_id):
+        if isinstance(stop_id, slice):
+            return [self[i] for i in range(*stop_id.indices(len(self)))]
+
+        return LatLng(self.__latitudes[stop_id], self.__longitudes[stop_id])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+# Distances (km) and times (seconds) between stop ids, stored in flat float32/int32 planes.
+# Existing planes (e.g. read from a snapshot, see snapshot.py) can be passed instead of allocating new ones.
+class DistanceTimeMatrix(object):
+    def __init__(self, size, distances = None, times = None):
+        if distances is not None and len(distances) != size * size: raise ValueError("The distance plane must contain size x size entries.")
+        if times is not None and len(times) != size * size: raise ValueError("The time plane must contain size x size entries.")
 
-                if col_key not in self.__col_keys:
-                    raise ValueError("Invalid column key '{0}'.".format(col_key))
+        self.size = size
+        self.distances = distances if distances is not None else array.array("f", [0.0]) * (size * size)
+        self.times = times if times is not None else array.array("i", [MISSING_TIME]) * (size * size)
 
-                actual_row_idx = self.__row_keys.index(row_key)
-                actual_col_idx = self.__col_keys.index(col_key)
+    def set_entry(self, from_id, to_id, distance, time):
+        idx = from_id * self.size + to_id
 
-                self.__matrix[actual_row_idx][actual_col_idx] = value
+        self.distances[idx] = distance
+        self.times[idx] = time
 
-    def get_entry(self, from_key, to_key):
-        if from_key not in self.__row_keys: return None
-        if to_key not in self.__col_keys: return None
+    # The departure time is ignored. It is accepted so the matrix can be used interchangeably with a TimeDependentMatrix.
+    def get_entry(self, from_id, to_id, departure_time = None):
+        if from_id < 0 or from_id >= self.size: return None
+        if to_id < 0 or to_id >= self.size: return None
 
-        row_idx = self.__row_keys.index(from_key)
-        col_idx = self.__col_keys.index(to_key)
+        idx = from_id * self.size + to_id
+        time = self.times[idx]
 
-        return self.__matrix[row_idx][col_idx]
+        if time == MISSING_TIME: return None
+
+        return DistTime(self.distances[idx], time)
 
     def __str__(self):
-        return str(self.__matrix)
+        return str([ [ self.get_entry(i, j) for j in range(self.size) ] for i in range(self.size) ])
+
+# Distance/time matrices for several departure time slices. Slices are expressed in seconds since midnight.
+class TimeDependentMatrix(object):
+    def __init__(self, slices, matrices):
+        if len(slices) == 0: raise ValueError("At least one time slice must be specified.")
+        if len(slices) != len(matrices): raise ValueError("A matrix must be specified for every time slice.")
+
+        self.slices = slices
+        self.matrices = matrices
+
+    def get_matrix(self, departure_time):
+        # Use the last slice that starts before the departure time. Departures before the first slice use the first one.
+        idx = max(bisect.bisect_right(self.slices, departure_time) - 1, 0)
+        return self.matrices[idx]
+
+    def get_entry(self, from_key, to_key, departure_time = None):
+        if departure_time is None: departure_time = self.slices[0]
+        return self.get_matrix(departure_time).get_entry(from_key, to_key)
+
+# Cached distances (km) and times (seconds) per origin and departure time. Coordinates are mapped to integer ids and every
+# origin row holds the sorted ids of its destinations with float32/int32 values, so a cached pair takes 12 bytes.
+class DistanceTimeCache(object):
+    def __init__(self):
+        self.__ids = {}
+        self.__rows = {}
+
+    def __len__(self):
+        return sum(len(row[0]) for row in self.__rows.values())
+
+    def get_id(self, coordinate):
+        result = self.__ids.get(coordinate)
+
+        if result is None:
+            result = len(self.__ids)
+            self.__ids[coordinate] = result
+
+        return result
+
+    # Returns a DistTime (or None if it isn't cached) for every destination id.
+    def get_entries(self, origin_id, destination_ids, departure_time = None):
+        row = self.__rows.get((origin_id, departure_time))
+        if row is None: return [None] * len(destination_ids)
+
+        ids, distances, times = row
+        result = []
+
+        for destination_id in destination_ids:
+            idx = bisect.bisect_left(ids, destination_id)
+            result.append(DistTime(distances[idx], times[idx]) if idx < len(ids) and ids[idx] == destination_id else None)
+
+        return result
+
+    # Merges the entries of an origin with the cached ones. Rows are rebuilt, so entries should be added in bulk.
+    def update(self, origin, departure_time, destinations, entries):
+        key = (self.get_id(origin), departure_time)
+        ids, distances, times = self.__rows.get(key, ((), (), ()))
+
+        merged = dict(zip(ids, zip(distances, times)))
+
+        for destination, entry in zip(destinations, entries):
+            merged[self.get_id(destination)] = (entry.distance, entry.time)
+
+        order = sorted(merged)
+
+        self.__rows[key] = (
+            array.array("i", order),
+            array.array("f", [merged[i][0] for i in order]),
+            array.array("i", [merged[i][1] for i in order]))
+
+    # Adds (origin, destination, departure time) -> DistTime pairs, grouped per origin row.
+    def update_pairs(self, pairs):
+        rows = collections.OrderedDict()
+
+        for (origin, destination, departure_time), entry in pairs:
+            row = rows.setdefault((origin, departure_time), ([], []))
+            row[0].append(destination)
+            row[1].append(entry)
+
+        for (origin, departure_time), (destinations, entries) in rows.items():
+            self.update(origin, departure_time, destinations, entries)
 
 class GeoHelper(object):
     GEOCODE_CACHE_FILE = "geocodecache.bin"
     DISTANCE_TIME_MATRIX_CACHE_FILE = "distancetimematrixcache.bin";
+    CHECKPOINT_FILE = "cachecheckpoint.bin"
 
-    def __init__(self, google_api_key, bing_api_key):
+    def __init__(self, google_api_key, bing_api_key, scheduler = None):
         self.__gmaps = googlemaps.Client(key = google_api_key)
         self.__bing_api_key = bing_api_key
+        self.__scheduler = scheduler or requestscheduler.RequestScheduler([])
         self.__geocode_cache = {}
-        self.__distance_matrix_cache = {}
+        self.__geocode_index = {}
+        self.__distance_matrix_cache = DistanceTimeCache()
+        self.__cache_lock = threading.RLock() # The helper can be shared by jobs running in parallel
+        self.__matrices_in_progress = 0 # Their results are only in the checkpoint until the matrix is done
 
     def load_cache(self):
-        if os.path.isfile(GeoHelper.GEOCODE_CACHE_FILE):
-            with open(GeoHelper.GEOCODE_CACHE_FILE, "rb") as f:
-                self.__geocode_cache = pickle.load(f)
+        with self.__cache_lock:
+            if os.path.isfile(GeoHelper.GEOCODE_CACHE_FILE):
+                with open(GeoHelper.GEOCODE_CACHE_FILE, "rb") as f:
+                    cache = pickle.load(f)
+
+                # Older caches are keyed on the raw address.
+                self.__geocode_cache = {}
+                self.__geocode_index = {}
+                for address, coords in cache.items():
+                    self.__add_to_geocode_cache(datahelpers.normalize_address(address), coords, checkpoint = False)
+
+            if os.path.isfile(GeoHelper.DISTANCE_TIME_MATRIX_CACHE_FILE):
+                with open(GeoHelper.DISTANCE_TIME_MATRIX_CACHE_FILE, "rb") as f2:
+                    cache = pickle.load(f2)
+
+                # Older caches are dictionaries of whole batches, keyed on the coordinates of the batch, or of single pairs.
+                if isinstance(cache, DistanceTimeCache):
+                    self.__distance_matrix_cache = cache
+                else:
+                    pairs = (pair for key, value in cache.items() for pair in (GeoHelper.__from_batch(key, value) if isinstance(key, str) else { key: value }).items())
+
+                    self.__distance_matrix_cache = DistanceTimeCache()
+                    self.__distance_matrix_cache.update_pairs(pairs)
 
-        if os.path.isfile(GeoHelper.DISTANCE_TIME_MATRIX_CACHE_FILE):
-            with open(GeoHelper.DISTANCE_TIME_MATRIX_CACHE_FILE, "rb") as f2:
-                self.__distance_matrix_cache = pickle.load(f2)
+            # Resume from the results of a run that didn't finish
+            self.__load_checkpoint()
 
     def persist_cache(self):
-        with open(GeoHelper.GEOCODE_CACHE_FILE, "wb") as f:
-            pickle.dump(self.__geocode_cache, f)
+        with self.__cache_lock:
+            with open(GeoHelper.GEOCODE_CACHE_FILE, "wb") as f:
+                pickle.dump(self.__geocode_cache, f)
+
+            with open(GeoHelper.DISTANCE_TIME_MATRIX_CACHE_FILE, "wb") as f2:
+                pickle.dump(self.__distance_matrix_cache, f2)
+
+            # Everything in the checkpoint is in the cache files now, unless a matrix is still being calculated
+            if self.__matrices_in_progress == 0 and os.path.isfile(GeoHelper.CHECKPOINT_FILE):
+                os.remove(GeoHelper.CHECKPOINT_FILE)
+
+    # Results are appended to the checkpoint as they arrive, so they survive a run that fails halfway.
+    def __checkpoint(self, records):
+        with open(GeoHelper.CHECKPOINT_FILE, "ab") as f:
+            for record in records:
+                pickle.dump(record, f)
+
+    def __load_checkpoint(self):
+        if not os.path.isfile(GeoHelper.CHECKPOINT_FILE): return
+
+        count = 0
+        pairs = []
+
+        with open(GeoHelper.CHECKPOINT_FILE, "rb") as f:
+            while True:
+                try:
+                    kind, key, value = pickle.load(f)
+                except EOFError:
+                    break
+                except pickle.UnpicklingError:
+                    break # The last record is incomplete if the run was interrupted while writing it
+
+                if kind == "geocode":
+                    self.__add_to_geocode_cache(key, value, checkpoint = False)
+                elif len(key) == 3: # A single pair, written by earlier versions
+                    pairs.append((key, value))
+                else:
+                    origin, departure_time = key
+                    pairs.extend(((origin, destination, departure_time), entry) for destination, entry in zip(*value))
+
+                count = count + 1
+
+        # Distance rows are merged at once, rather than per batch
+        self.__distance_matrix_cache.update_pairs(pairs)
+
+        logger.info("Resumed {0} cached results from the previous run.".format(count))
+
+    @staticmethod
+    def __from_batch(key, value):
+        # Batch keys are "<origin>:<origin>...-<destination>:...[@<departure time>]"
+        departure_time = None
+        if "@" in key:
+            key, departure = key.split("@")
+            departure_time = int(departure)
+
+        key_origin, key_dest = BATCH_KEY_SEPARATOR.split(key)
+        origins = [LatLng(float(lat), float(lng)) for lat, lng in COORDINATE_PATTERN.findall(key_origin)]
+        destinations = [LatLng(float(lat), float(lng)) for lat, lng in COORDINATE_PATTERN.findall(key_dest)]
+
+        result = {}
+
+        for i, origin in enumerate(origins):
+            for j, destination in enumerate(destinations):
+                if isinstance(value, tuple): # Distance and time planes
+                    distance, time = value[0][i * len(destinations) + j], value[1][i * len(destinations) + j]
+                    entry = DistTime(distance, time) if time != MISSING_TIME else None
+                else:
+                    entry = value[i][j] or None
+
+                if entry: result[(origin, destination, departure_time)] = entry
+
+        return result
+
+    def __add_to_geocode_cache(self, key, coords, checkpoint = True):
+        with self.__cache_lock:
+            self.__geocode_cache[key] = coords
+
+            signature = datahelpers.get_address_signature(key)
+            if signature: self.__geocode_index.setdefault(signature, coords)
 
-        with open(GeoHelper.DISTANCE_TIME_MATRIX_CACHE_FILE, "wb") as f2:
-            pickle.dump(self.__distance_matrix_cache, f2)
+            if checkpoint: self.__checkpoint([("geocode", key, coords)])
+
+    def __find_near_match(self, key):
+        signature = datahelpers.get_address_signature(key)
+        if not signature: return None
+
+        return self.__geocode_index.get(signature)
 
     def geocode(self, address):
         logger.info("Getting coordinates for address '{0}'".format(address))
 
+        key = datahelpers.normalize_address(address)
+
         # If the coordinates have already been calculated, return them from cache.
-        if address in self.__geocode_cache:
-            return self.__geocode_cache[address]
+        if key in self.__geocode_cache:
+            return self.__geocode_cache[key]
+
+        # Reuse the coordinates of an address with the same full postal code, street and house number (e.g. a different city spelling).
+        result = self.__find_near_match(key)
+        if result:
+            logger.info("Using coordinates of a similar address for '{0}'".format(address))
+            self.__add_to_geocode_cache(key, result)
+            return result
 
+        self.__scheduler.acquire(requestscheduler.GOOGLE)
         geo = self.__gmaps.geocode(address)
 
         if len(geo) == 0 or (not "geometry" in geo[0]) or (not "location" in geo[0]["geometry"]):
@@ -92,18 +324,13 @@ class GeoHelper(object):
             geo[0]["geometry"]["location"]["lng"])
 
         # Update the cache
-        self.__geocode_cache[address] = result
+        self.__add_to_geocode_cache(key, result)
 
         return result
 
-    def __get_bing_distance_matrix(self, origins, destinations):
-        # If the matrix has already been calculated, return it from cache.
-        key_origin = ":".join([str(coord) for coord in origins])       
-        key_dest = ":".join([str(coord) for coord in destinations])
-        cache_key = key_origin + "-" + key_dest
-
-        if cache_key in self.__distance_matrix_cache:
-            return self.__distance_matrix_cache[cache_key]
+    # Returns a list of (origin index, destination index, DistTime) results.
+    def __get_bing_distance_matrix(self, origins, destinations, departure_time = None):
+        self.__scheduler.acquire(requestscheduler.BING, len(origins) * len(destinations))
 
         body = {
             "origins": [],
@@ -113,6 +340,10 @@ class GeoHelper(object):
             "distanceUnit": "km"
         }
 
+        if departure_time is not None:
+            start_time = datetime.datetime.combine(datetime.date.today(), datetime.time()) + datetime.timedelta(seconds = departure_time)
+            body["startTime"] = start_time.isoformat()
+
         for coordinate in origins:
             obj = {
                 "latitude": coordinate.latitude,
@@ -137,7 +368,7 @@ class GeoHelper(object):
 
         results = response_json["resourceSets"][0]["resources"][0]["results"]
 
-        matrix = [ [ 0 for i in range(len(destinations)) ] for j in range(len(origins)) ]
+        matrix = []
 
         for result in results:
             origin_idx = int(result["originIndex"])
@@ -145,31 +376,91 @@ class GeoHelper(object):
             distance = float(result["travelDistance"]) if "travelDistance" in result else float(0)
             duration = int(result["travelDuration"]) if "travelDuration" in result else int(0)
 
-            matrix[origin_idx][dest_idx] = DistTime(distance, duration)
-
-        # Update the cache
-        self.__distance_matrix_cache[cache_key] = matrix
+            matrix.append((origin_idx, dest_idx, DistTime(distance, duration)))
 
         return matrix
 
-
-    def calculate_distance_time_matrix(self, coordinates):
+    # The matrix is indexed by the position (stop id) of the coordinates.
+    def calculate_distance_time_matrix(self, coordinates, departure_time = None):
         logger.info("Calculating time and distance between locations.")
 
-        # Split in batches of 20
-        batches = list(utils.split_in_batches(coordinates, 20))
+        coordinates = list(coordinates)
+        size = len(coordinates)
+        result = DistanceTimeMatrix(size)
+
+        # Take everything that is known from the cache. Time dependent entries are cached per time slice, regardless of the date.
+        missing = {}
+
+        with self.__cache_lock:
+            cache_ids = [self.__distance_matrix_cache.get_id(coordinate) for coordinate in coordinates]
+
+            for i, origin_id in enumerate(cache_ids):
+                for j, entry in enumerate(self.__distance_matrix_cache.get_entries(origin_id, cache_ids, departure_time)):
+                    if entry: result.set_entry(i, j, entry.distance, entry.time)
+                    else: missing.setdefault(i, []).append(j)
+
+        # Request the missing entries in as few requests as possible
+        batches = requestscheduler.coalesce(missing, MATRIX_BATCH_SIZE)
+        received = {}
+        completed = False
+
+        with self.__cache_lock:
+            self.__matrices_in_progress = self.__matrices_in_progress + 1
+
+        try:
+            for n, (origin_ids, destination_ids) in enumerate(batches):
+                logger.info("batch: {0} of {1} ({2}x{3})".format(n + 1, len(batches), len(origin_ids), len(destination_ids)))
+
+                origins = [coordinates[stop_id] for stop_id in origin_ids]
+                destinations = [coordinates[stop_id] for stop_id in destination_ids]
 
-        result = DistanceTimeMatrix(coordinates, coordinates)
+                rows = {}
 
-        for i, batch in enumerate(batches):
-            for j, other_batch in enumerate(batches):
-                logger.info("batch: {0}, {1}".format(i, j))
+                for origin_idx, dest_idx, entry in self.__get_bing_distance_matrix(origins, destinations, departure_time):
+                    result.set_entry(origin_ids[origin_idx], destination_ids[dest_idx], entry.distance, entry.time)
+                    rows.setdefault(origin_ids[origin_idx], ([], []))
+                    rows[origin_ids[origin_idx]][0].append(destinations[dest_idx])
+                    rows[origin_ids[origin_idx]][1].append(entry)
 
-                matrix = self.__get_bing_distance_matrix(batch, other_batch)
-                result.add_matrix(batch, other_batch, matrix)
+                # The checkpoint holds a record per origin row of the batch
+                with self.__cache_lock:
+                    self.__checkpoint([("distance", (coordinates[origin_id], departure_time), row) for origin_id, row in rows.items()])
+
+                for origin_id, (row_destinations, row_entries) in rows.items():
+                    received.setdefault(origin_id, ([], []))
+                    received[origin_id][0].extend(row_destinations)
+                    received[origin_id][1].extend(row_entries)
+
+            completed = True
+        finally:
+            # Cache rows are rebuilt when they're updated, so they're updated once with everything that was received.
+            with self.__cache_lock:
+                for origin_id, (row_destinations, row_entries) in received.items():
+                    self.__distance_matrix_cache.update(coordinates[origin_id], departure_time, row_destinations, row_entries)
+
+                self.__matrices_in_progress = self.__matrices_in_progress - 1
+
+            # The caller only persists the cache when all matrices are calculated, so the results that were paid for are saved now.
+            if not completed and received: self.__persist_after_failure()
 
         return result
 
+    def __persist_after_failure(self):
+        try:
+            self.persist_cache()
+        except Exception:
+            logger.exception("Unable to save the distance/time results of the failed calculation.")
+
+    def calculate_time_dependent_matrix(self, coordinates, slices):
+        slices = sorted(slices)
+        matrices = []
+
+        for departure_time in slices:
+            logger.info("Calculating time and distance for departures at {0}.".format(datetime.timedelta(seconds = departure_time)))
+            matrices.append(self.calculate_distance_time_matrix(coordinates, departure_time))
+
+        return TimeDependentMatrix(slices, matrices)
+
     def __get_bing_map_image(self, locations):
         # Build waypoint string
         waypoints = ""
@@ -180,6 +471,7 @@ class GeoHelper(object):
         waypoints = waypoints.strip("&") # Remvoe leading and trailing ampersands
 
         # Download the file
+        self.__scheduler.acquire(requestscheduler.BING)
         url = "https://dev.virtualearth.net/REST/v1/Imagery/Map/Road/Routes/driving?{0}&format=jpeg&mapSize=600,600&declutterPins=1&key={1}".format(waypoints, self.__bing_api_key)
 
         response = requests.get(url, stream = True)
@@ -192,13 +484,13 @@ class GeoHelper(object):
 
             return f.name
 
-    def get_map_images(self, solution):
+    def get_map_images(self, solution, coordinates):
         result = []
 
         for i, vehicle in enumerate(solution.vehicles):
             logger.info("Getting map image for vehicle {0}.".format(i + 1))
 
-            locations = [node.location for node in vehicle.nodes]
+            locations = [coordinates[node.index] for node in vehicle.nodes]
             path = self.__get_bing_map_image(locations)
 
             result.append(path)
@@ -0,0 +1,245 @@
+import excel
+import os.path
+import logging
+import geoservices
+import datahelpers
+import evaluation
+import datetime
+import threading
+import snapshot
+import requestscheduler
+import sharedmatrix
+from solver import Solver
+
+TIME_LIMIT_SOLUTION_MS = 120000 # 2 minutes (by trial and error)
+
+logger = logging.getLogger()
+
+_geo_helpers = {}
+_geo_helpers_lock = threading.Lock()
+_scheduler = requestscheduler.RequestScheduler([]) # Shared by all geo helpers, so the API usage is counted once
+
+def get_budgets(configuration):
+    budgets = []
+
+    for provider in (requestscheduler.GOOGLE, requestscheduler.BING):
+        daily_limit = configuration.get("{0}_daily_quota".format(provider))
+        daily_limit = int(daily_limit) if daily_limit not in (None, "") else None
+
+        budgets.append(requestscheduler.ProviderBudget(provider, requestscheduler.DEFAULT_REQUESTS_PER_SECOND[provider], daily_limit))
+
+    return budgets
+
+def create_geo_helper(configuration):
+    geo_helper = geoservices.GeoHelper(configuration["google_api_key"], configuration["bing_api_key"], _scheduler)
+    geo_helper.load_cache() # Load cache from filesystem
+    return geo_helper
+
+# Geo helpers are kept per set of API keys, so their caches stay warm across runs. The quotas of the configuration apply from now on.
+def get_geo_helper(configuration):
+    key = (configuration["google_api_key"], configuration["bing_api_key"])
+
+    _scheduler.set_budgets(get_budgets(configuration))
+
+    with _geo_helpers_lock:
+        if key not in _geo_helpers:
+            _geo_helpers[key] = create_geo_helper(configuration)
+
+        return _geo_helpers[key]
+
+class Problem(object):
+    def __init__(self, record_set, locations, matrix, time_windows, service_times, drop_penalties, pickup_deliveries, time_slices):
+        self.record_set = record_set
+        self.locations = locations # Coordinates per stop id. The first location is the start location.
+        self.matrix = matrix
+        self.time_windows = time_windows
+        self.service_times = service_times
+        self.drop_penalties = drop_penalties
+        self.pickup_deliveries = pickup_deliveries
+        self.time_slices = time_slices
+
+# Reads and validates the locations in the source file and calculates their coordinates and distances.
+def load_problem(configuration, source_file, geo_helper = None):
+    ensure_source_file_exist(source_file)
+
+    # Load the data from the input file
+    record_set = excel.read_locations(source_file)
+
+    # Validate all time windows and stop options up front, before paying for any API calls.
+    service_time_seconds = int(configuration["service_time"]) * 60
+
+    time_windows = datahelpers.get_time_windows_from_entries(record_set.entries)
+    service_times = datahelpers.get_service_times_from_entries(record_set.entries, service_time_seconds)
+    drop_penalties = datahelpers.get_drop_penalties_from_entries(record_set.entries)
+    pickup_deliveries = datahelpers.get_pickup_deliveries_from_entries(record_set.entries)
+
+    # Resolve coordinates and get time windows
+    if geo_helper is None: geo_helper = get_geo_helper(configuration)
+
+    locations = geoservices.Locations()
+
+    start_address = configuration["start_address"]
+    start_coord = geo_helper.geocode(start_address)
+    locations.append(start_coord)
+
+    for entry in record_set.entries:
+        address = datahelpers.get_address_from_entry(entry, configuration["default_country"])
+        coords = geo_helper.geocode(address)
+        locations.append(coords)
+
+    # Calculate distances. When traffic slices are configured, a matrix is calculated for every departure time slice.
+    time_slices = datahelpers.get_time_slices(configuration.get("traffic_slices", ""))
+
+    if time_slices:
+        matrix = geo_helper.calculate_time_dependent_matrix(locations, time_slices)
+    else:
+        matrix = geo_helper.calculate_distance_time_matrix(locations)
+
+    # Save file to filesystem for reuse
+    geo_helper.persist_cache()
+
+    # The start location has no time window and the default service time.
+    return Problem(record_set, locations, matrix,
+                   [[(0, 0)]] + time_windows,
+                   [service_time_seconds] + service_times,
+                   drop_penalties, pickup_deliveries, time_slices)
+
+# Creates a problem from a snapshot written by a previous run.
+def load_snapshot_problem(snapshot_file):
+    value = snapshot.read_snapshot(snapshot_file)
+
+    # The locations, matrix and stop options are taken from the snapshot. The options are logged so runs can be compared.
+    options = ", ".join("{0}={1}".format(key, value.configuration[key]) for key in sorted(value.configuration))
+    logger.info("Replaying a snapshot of {0} locations planned with options: {1}.".format(len(value.locations) - 1, options))
+
+    return Problem(value.record_set, value.locations, value.matrix, value.time_windows, value.service_times,
+                   value.drop_penalties, value.pickup_deliveries, value.time_slices)
+
+# Plans the locations in the source file and writes the solution to the destination file. Returns None if no solution could be found.
+# A snapshot of the problem is written alongside the destination file, so the run can be repeated offline.
+# When a multiprocessing pool is given, the solution is calculated by one of its worker processes.
+def plan(configuration, source_file, destination_file, geo_helper = None, pool = None):
+    if geo_helper is None: geo_helper = get_geo_helper(configuration)
+
+    problem = load_problem(configuration, source_file, geo_helper)
+    snapshot.write_snapshot(snapshot.get_snapshot_path(destination_file), problem, configuration)
+
+    solution = solve_problem(problem, TIME_LIMIT_SOLUTION_MS, pool)
+    if not solution: return None
+
+    write_output(problem, solution, destination_file, geo_helper)
+
+    return solution
+
+# Solves a snapshot without any API calls. The map images are left out of the output.
+def plan_from_snapshot(snapshot_file, destination_file, time_limit_ms = TIME_LIMIT_SOLUTION_MS):
+    problem = load_snapshot_problem(snapshot_file)
+
+    solution = solve_problem(problem, time_limit_ms)
+    if not solution: return None
+
+    write_output(problem, solution, destination_file)
+
+    return solution
+
+def solve_problem(problem, time_limit_ms, pool = None):
+    if pool is None:
+        return _solve(problem.matrix, problem.time_windows, problem.service_times, problem.drop_penalties, problem.pickup_deliveries, bool(problem.time_slices), time_limit_ms)
+
+    # Only the descriptor of the matrix is sent to the worker, which maps the matrix file instead of unpickling a copy.
+    with sharedmatrix.SharedMatrix(problem.matrix) as shared:
+        logger.info("Calculating solution in a worker process.")
+
+        return pool.apply(_solve_shared, (shared.descriptor, problem.time_windows, problem.service_times, problem.drop_penalties,
+                                          problem.pickup_deliveries, bool(problem.time_slices), time_limit_ms))
+
+# Runs in a worker process.
+def _solve_shared(descriptor, time_windows, service_times, drop_penalties, pickup_deliveries, time_dependent, time_limit_ms):
+    with sharedmatrix.attach_matrix(descriptor) as matrix:
+        return _solve(matrix, time_windows, service_times, drop_penalties, pickup_deliveries, time_dependent, time_limit_ms)
+
+# time_windows and service_times contain a value for every location, including the start location. drop_penalties excludes the start location.
+def _solve(matrix, time_windows, service_times, drop_penalties, pickup_deliveries, time_dependent, time_limit_ms):
+    # The solver works on stop ids and adds the start location (0) itself.
+    num_locations = len(time_windows)
+
+    solver = Solver(0, list(range(1, num_locations)), time_windows[1:], service_times[0], num_locations - 1, time_limit_ms,
+                    service_times = service_times[1:],
+                    drop_penalties = list(drop_penalties),
+                    pickup_deliveries = pickup_deliveries)
+    solver.travel_time_callback = travel_time_callback(matrix)
+    if time_dependent: solver.time_dependent_travel_time_callback = time_dependent_travel_time_callback(matrix)
+    solver.travel_distance_callback = travel_distance_callback(matrix)
+    return solver.solve()
+
+def write_output(problem, solution, destination_file, geo_helper = None):
+    for location in solution.dropped:
+        logger.warning("Unable to plan row {0}: '{1}'.".format(location - 1 + datahelpers.FIRST_DATA_ROW, problem.record_set.entries[location - 1].get("address", "")))
+
+    metrics = evaluation.evaluate(solution, problem.matrix, problem.time_windows, problem.service_times, [None] + problem.drop_penalties)
+    log_metrics(metrics)
+
+    # Get images for solution
+    images = geo_helper.get_map_images(solution, problem.locations) if geo_helper else None
+
+    # Write output excel file
+    excel.write_solution(solution, metrics, images, problem.record_set, problem.service_times, destination_file)
+
+# Recalculates the routes in a (manually edited) output file and validates them against the locations in the source file.
+def evaluate_routes(configuration, source_file, routes_file, geo_helper = None):
+    problem = load_problem(configuration, source_file, geo_helper)
+
+    routes = excel.read_routes(routes_file, problem.record_set)
+    solution = evaluation.simulate(routes, problem.matrix, problem.time_windows, problem.service_times)
+    metrics = evaluation.evaluate(solution, problem.matrix, problem.time_windows, problem.service_times, [None] + problem.drop_penalties)
+
+    for vehicle in solution.vehicles:
+        for node in vehicle.nodes[1:-1]:
+            if evaluation.get_window_violation(node.time, problem.time_windows[node.index]) > 0:
+                logger.warning("Row {0} is visited outside of its time windows.".format(node.index - 1 + datahelpers.FIRST_DATA_ROW))
+
+    for location in solution.dropped:
+        logger.warning("Row {0} is not visited.".format(location - 1 + datahelpers.FIRST_DATA_ROW))
+
+    log_metrics(metrics)
+
+    return metrics
+
+def log_metrics(metrics):
+    logger.info("Vehicles: {0}, distance: {1:.1f} km, travel time: {2}, idle time: {3}, window violations: {4}, unplanned: {5}, cost: {6}.".format(
+        metrics.vehicles,
+        metrics.distance,
+        datetime.timedelta(seconds = metrics.travel_time),
+        datetime.timedelta(seconds = metrics.idle_time),
+        metrics.violations,
+        metrics.dropped,
+        metrics.cost))
+
+def travel_time_callback(matrix):
+    def callback(from_loc, to_loc):
+        # Get time from the matrix
+        entry = matrix.get_entry(from_loc, to_loc)
+        if entry is None: raise ValueError("Unable to find distance/time between addresses.")
+        return entry.time
+    return callback
+
+def time_dependent_travel_time_callback(matrix):
+    def callback(from_loc, to_loc, departure_time):
+        # Get time from the matrix of the time slice
+        entry = matrix.get_entry(from_loc, to_loc, departure_time)
+        if entry is None: raise ValueError("Unable to find distance/time between addresses.")
+        return entry.time
+    return callback
+
+def travel_distance_callback(matrix):
+    def callback(from_loc, to_loc):
+        # Get distance from the matrix
+        entry = matrix.get_entry(from_loc, to_loc)
+        if entry is None: raise ValueError("Unable to find distance/time between addresses.")
+        return int(float(entry.distance) * 1000)
+    return callback
+
+def ensure_source_file_exist(source_file):
+    # Make sure the source file exists
+    if not os.path.isfile(source_file):
+        raise ValueError("Unable to find the specified source file. Make sure the file exists.")
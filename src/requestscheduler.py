@@ -0,0 +1,92 @@
+import collections
+import threading
+import datetime
+import logging
+import json
+import time
+import os.path
+
+logger = logging.getLogger()
+
+GOOGLE = "google"
+BING = "bing"
+DEFAULT_REQUESTS_PER_SECOND = { GOOGLE: 50, BING: 5 }
+
+# Daily limit is the maximum amount of units (requests or matrix elements) per day, None for no limit.
+ProviderBudget = collections.namedtuple("ProviderBudget", ["provider", "requests_per_second", "daily_limit"])
+
+# Keeps track of the API usage per provider, enforces the rate and daily budgets and persists the usage of the day.
+class RequestScheduler(object):
+    USAGE_FILE = "apiusage.json"
+
+    def __init__(self, budgets):
+        self.__budgets = { budget.provider: budget for budget in budgets }
+        self.__last_request = {}
+        self.__lock = threading.Lock()
+        self.__usage = self.__load_usage()
+
+    def set_budgets(self, budgets):
+        with self.__lock:
+            self.__budgets = { budget.provider: budget for budget in budgets }
+
+    def acquire(self, provider, units = 1):
+        budget = self.__budgets.get(provider)
+        if budget is None: return
+
+        with self.__lock:
+            today = datetime.date.today().isoformat()
+
+            if self.__usage.get("date") != today:
+                self.__usage = { "date": today, "providers": {} }
+
+            used = self.__usage["providers"].get(provider, 0)
+
+            if budget.daily_limit is not None and used + units > budget.daily_limit:
+                raise ValueError("The daily {0} quota of {1} would be exceeded ({2} used, {3} needed). Please try again tomorrow or raise the quota.".format(provider, budget.daily_limit, used, units))
+
+            # Respect the rate limit of the provider
+            if budget.requests_per_second:
+                interval = 1.0 / budget.requests_per_second
+                wait = self.__last_request.get(provider, 0) + interval - time.monotonic()
+                if wait > 0: time.sleep(wait)
+
+            self.__last_request[provider] = time.monotonic()
+            self.__usage["providers"][provider] = used + units
+            self.__persist_usage()
+
+    def get_usage(self, provider):
+        with self.__lock:
+            if self.__usage.get("date") != datetime.date.today().isoformat(): return 0
+            return self.__usage["providers"].get(provider, 0)
+
+    def __load_usage(self):
+        if not os.path.isfile(RequestScheduler.USAGE_FILE): return {}
+
+        try:
+            with open(RequestScheduler.USAGE_FILE, "r") as f:
+                return json.load(f)
+        except ValueError:
+            logger.warning("Unable to read the API usage file. The usage is reset.")
+            return {}
+
+    def __persist_usage(self):
+        with open(RequestScheduler.USAGE_FILE, "w") as f:
+            json.dump(self.__usage, f)
+
+# Packs the missing entries of a matrix into as few requests as possible.
+# missing maps an origin to the list of destinations that are missing for it. Returns a list of (origins, destinations) requests,
+# each at most batch_size x batch_size. Origins that miss the same destinations are combined in the same requests.
+def coalesce(missing, batch_size):
+    groups = collections.OrderedDict()
+
+    for origin, destinations in missing.items():
+        if destinations: groups.setdefault(tuple(destinations), []).append(origin)
+
+    result = []
+
+    for destinations, origins in groups.items():
+        for i in range(0, len(origins), batch_size):
+            for j in range(0, len(destinations), batch_size):
+                result.append((origins[i:i + batch_size], list(destinations[j:j + batch_size])))
+
+    return result
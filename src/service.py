@@ -0,0 +1,223 @@
+import http.server
+import socketserver
+import concurrent.futures
+import threading
+import logging
+import json
+import uuid
+import enum
+import collections
+import multiprocessing
+import configuration
+import planner
+from client import DEFAULT_HOST, DEFAULT_PORT
+
+DEFAULT_MAX_WORKERS = 2
+DESTINATION_EXTENSION = ".xlsx" # Jobs can only write workbooks (and the snapshot alongside them)
+MAX_FINISHED_JOBS = 100 # Finished jobs (and their logs) that are kept, the oldest ones are forgotten
+
+logger = logging.getLogger()
+
+class JobStatus(enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    NO_SOLUTION = "no_solution"
+    FAILED = "failed"
+
+class Job(object):
+    def __init__(self, configuration, source_file, destination_file):
+        self.id = uuid.uuid4().hex
+        self.configuration = configuration
+        self.source_file = source_file
+        self.destination_file = destination_file
+        self.status = JobStatus.QUEUED
+        self.error = None
+        self.log = []
+        self.vehicles = None
+        self.dropped = None
+
+    def is_finished(self):
+        return self.status not in (JobStatus.QUEUED, JobStatus.RUNNING)
+
+    def to_dict(self, include_log = True):
+        result = {
+            "id": self.id,
+            "status": self.status.value,
+            "source_file": self.source_file,
+            "destination_file": self.destination_file,
+            "error": self.error,
+            "vehicles": self.vehicles,
+            "dropped": self.dropped
+        }
+
+        if include_log: result["log"] = self.log
+
+        return result
+
+# Routes log records to the job that is running on the current thread.
+class JobLogHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.__jobs = {}
+
+    def register(self, job):
+        self.__jobs[threading.get_ident()] = job
+
+    def unregister(self):
+        self.__jobs.pop(threading.get_ident(), None)
+
+    def emit(self, record):
+        job = self.__jobs.get(threading.get_ident())
+        if job: job.log.append([record.levelname, self.format(record)])
+
+class PlanningService(object):
+    def __init__(self, max_workers = DEFAULT_MAX_WORKERS):
+        if (max_workers <= 0): raise ValueError("Argument 'max_workers' must be greater than 0.")
+
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers = max_workers)
+
+        # The solver callbacks are Python code that needs the GIL, so solutions are calculated in processes to run in parallel.
+        # Workers are spawned rather than forked, since forking a process with running threads isn't safe.
+        self.__solver_pool = multiprocessing.get_context("spawn").Pool(max_workers)
+        self.__jobs = collections.OrderedDict() # In order of submission
+        self.__lock = threading.Lock()
+
+        self.__log_handler = JobLogHandler()
+        self.__log_handler.setLevel(logging.INFO)
+        self.__log_handler.setFormatter(logging.Formatter("%(message)s"))
+        logging.getLogger().addHandler(self.__log_handler)
+
+    def submit(self, values, source_file, destination_file):
+        # Options that aren't specified are taken from the configuration file.
+        config = configuration.load_config()
+        config.update(values)
+        configuration.validate_config(config)
+
+        if not destination_file.lower().endswith(DESTINATION_EXTENSION):
+            raise ValueError("The destination file must be an excel workbook ({0}).".format(DESTINATION_EXTENSION))
+
+        job = Job(config, source_file, destination_file)
+
+        with self.__lock:
+            self.__jobs[job.id] = job
+
+        self.__executor.submit(self.__run, job)
+
+        return job
+
+    def get_job(self, job_id):
+        return self.__jobs.get(job_id)
+
+    def get_jobs(self):
+        with self.__lock:
+            return list(self.__jobs.values())
+
+    def shutdown(self):
+        self.__executor.shutdown()
+        self.__solver_pool.close()
+        self.__solver_pool.join()
+
+    def __run(self, job):
+        self.__log_handler.register(job)
+        job.status = JobStatus.RUNNING
+
+        try:
+            solution = planner.plan(job.configuration, job.source_file, job.destination_file, planner.get_geo_helper(job.configuration), self.__solver_pool)
+
+            if not solution:
+                job.status = JobStatus.NO_SOLUTION
+            else:
+                job.vehicles = len(solution.vehicles)
+                job.dropped = solution.dropped
+                job.status = JobStatus.DONE
+        except Exception as e:
+            logger.exception("Job {0} failed.".format(job.id))
+            job.error = str(e)
+            job.status = JobStatus.FAILED
+        finally:
+            self.__log_handler.unregister()
+            self.__forget_finished_jobs()
+
+    def __forget_finished_jobs(self):
+        with self.__lock:
+            finished = [job_id for job_id, job in self.__jobs.items() if job.is_finished()]
+
+            for job_id in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+                del self.__jobs[job_id]
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    service = None
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+
+        if parts == ["jobs"]:
+            # The logs can be long, they're only returned per job.
+            self.__send(200, [job.to_dict(include_log = False) for job in self.service.get_jobs()])
+        elif len(parts) == 2 and parts[0] == "jobs":
+            job = self.service.get_job(parts[1])
+            if job: self.__send(200, job.to_dict())
+            else: self.__send(404, { "error": "Job not found." })
+        else:
+            self.__send(404, { "error": "Not found." })
+
+    def do_POST(self):
+        if self.path.strip("/") != "jobs":
+            self.__send(404, { "error": "Not found." })
+            return
+
+        # Browsers add an Origin header to cross-site requests and need a CORS preflight for JSON, which isn't answered.
+        # This keeps web pages from submitting jobs to the local service.
+        if self.headers.get("Origin") is not None:
+            self.__send(403, { "error": "Requests from web pages are not allowed." })
+            return
+
+        if self.headers.get("Content-Type", "").split(";")[0].strip().lower() != "application/json":
+            self.__send(415, { "error": "The request body must be JSON (application/json)." })
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length).decode("utf-8"))
+
+            if not isinstance(body, dict): raise ValueError("The request body must be a JSON object.")
+            if not isinstance(body.get("configuration", {}), dict): raise ValueError("The configuration must be a JSON object.")
+            if not isinstance(body.get("source_file"), str): raise ValueError("Please specify a source file.")
+            if not isinstance(body.get("destination_file"), str): raise ValueError("Please specify a destination file.")
+
+            job = self.service.submit(body.get("configuration", {}), body["source_file"], body["destination_file"])
+        except ValueError as e:
+            self.__send(400, { "error": str(e) })
+            return
+
+        self.__send(202, job.to_dict())
+
+    def log_message(self, format, *args):
+        # Requests are polled frequently, don't flood the log with them.
+        logger.debug(format % args)
+
+    def __send(self, status, value):
+        body = json.dumps(value).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+def serve(host = DEFAULT_HOST, port = DEFAULT_PORT, max_workers = DEFAULT_MAX_WORKERS):
+    service = PlanningService(max_workers)
+    RequestHandler.service = service
+
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    logger.info("Planning service listening on http://{0}:{1} with {2} worker(s).".format(host, port, max_workers))
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        service.shutdown()
@@ -0,0 +1,101 @@
+import collections
+import tempfile
+import logging
+import weakref
+import mmap
+import os
+import geoservices
+
+logger = logging.getLogger()
+
+PLANE_ITEM_SIZE = 4 # Distances are float32, times int32
+
+# Describes a matrix in a memory-mapped file. It is small and cheap to pass to worker processes.
+# slices is None for a DistanceTimeMatrix, or the time slices of a TimeDependentMatrix.
+SharedMatrixDescriptor = collections.namedtuple("SharedMatrixDescriptor", ["path", "size", "slices"])
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        # On Windows the file can't be removed while a worker still has it mapped.
+        logger.warning("Unable to remove shared matrix '{0}'.".format(path))
+
+# Copies the planes of a (time dependent) matrix to a memory-mapped file, so worker processes can read them without copying.
+# The file is removed by close(), or at the latest when the object is garbage collected or the process exits.
+class SharedMatrix(object):
+    def __init__(self, matrix):
+        if isinstance(matrix, geoservices.TimeDependentMatrix):
+            slices = list(matrix.slices)
+            matrices = matrix.matrices
+        else:
+            slices = None
+            matrices = [matrix]
+
+        size = matrices[0].size
+
+        fd, path = tempfile.mkstemp(suffix = ".matrix")
+        self.__finalizer = weakref.finalize(self, _remove_file, path)
+
+        with os.fdopen(fd, "wb") as f:
+            for m in matrices:
+                if m.size != size: raise ValueError("All matrices must have the same size.")
+
+                f.write(memoryview(m.distances).cast("B"))
+                f.write(memoryview(m.times).cast("B"))
+
+        self.descriptor = SharedMatrixDescriptor(path, size, slices)
+
+    def close(self):
+        self.__finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# A matrix mapped from the file of a SharedMatrix. The planes of the matrix are read-only views on the file,
+# which are released by close(). Used as a context manager, it returns the matrix.
+class AttachedMatrix(object):
+    def __init__(self, descriptor):
+        plane_count = len(descriptor.slices) if descriptor.slices is not None else 1
+        plane_bytes = descriptor.size * descriptor.size * PLANE_ITEM_SIZE
+
+        with open(descriptor.path, "rb") as f:
+            self.__buffer = mmap.mmap(f.fileno(), plane_count * 2 * plane_bytes, access = mmap.ACCESS_READ)
+
+        self.__views = [memoryview(self.__buffer)]
+        matrices = []
+
+        for i in range(plane_count):
+            offset = i * 2 * plane_bytes
+            distances = self.__views[0][offset:offset + plane_bytes]
+            times = self.__views[0][offset + plane_bytes:offset + 2 * plane_bytes]
+
+            self.__views.extend([distances, times, distances.cast("f"), times.cast("i")])
+            matrices.append(geoservices.DistanceTimeMatrix(descriptor.size, self.__views[-2], self.__views[-1]))
+
+        if descriptor.slices is None:
+            self.matrix = matrices[0]
+        else:
+            self.matrix = geoservices.TimeDependentMatrix(list(descriptor.slices), matrices)
+
+    def close(self):
+        self.matrix = None
+
+        # Derived views must be released before the views and the map they're based on.
+        for view in reversed(self.__views):
+            view.release()
+
+        self.__views = []
+        self.__buffer.close()
+
+    def __enter__(self):
+        return self.matrix
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def attach_matrix(descriptor):
+    return AttachedMatrix(descriptor)
@@ -0,0 +1,94 @@
+import collections
+import zipfile
+import array
+import json
+import sys
+import excel
+import geoservices
+
+SNAPSHOT_EXTENSION = ".vrps"
+SNAPSHOT_VERSION = 1
+PRIVATE_OPTIONS = ["google_api_key", "bing_api_key"] # Never written to a snapshot
+NO_DROP_PENALTY = -1 # Marks mandatory locations in the drop penalty column
+
+Snapshot = collections.namedtuple("Snapshot", ["configuration", "record_set", "locations", "matrix", "time_windows", "service_times", "drop_penalties", "pickup_deliveries", "time_slices"])
+
+def get_snapshot_path(destination_file):
+    # The snapshot is written alongside the output workbook (e.g. "routes.xlsx.vrps")
+    return destination_file + SNAPSHOT_EXTENSION
+
+# Writes the problem to a zip file with a json header and a binary column per value, so it can be solved again without any API calls.
+def write_snapshot(path, problem, configuration):
+    matrices = problem.matrix.matrices if problem.time_slices else [problem.matrix]
+
+    columns = {
+        "latitudes": array.array("d", [coordinate.latitude for coordinate in problem.locations]),
+        "longitudes": array.array("d", [coordinate.longitude for coordinate in problem.locations]),
+        "window_counts": array.array("i", [len(windows) for windows in problem.time_windows]),
+        "window_starts": array.array("i", [start for windows in problem.time_windows for start, end in windows]),
+        "window_ends": array.array("i", [end for windows in problem.time_windows for start, end in windows]),
+        "service_times": array.array("i", problem.service_times),
+        "drop_penalties": array.array("q", [NO_DROP_PENALTY if penalty is None else penalty for penalty in problem.drop_penalties])
+    }
+
+    for i, matrix in enumerate(matrices):
+        columns["distances_{0}".format(i)] = matrix.distances
+        columns["times_{0}".format(i)] = matrix.times
+
+    header = {
+        "version": SNAPSHOT_VERSION,
+        "byteorder": sys.byteorder,
+        "configuration": { key: value for key, value in configuration.items() if key not in PRIVATE_OPTIONS },
+        "columns": [ [name, column.typecode] for name, column in columns.items() ],
+        "record_columns": problem.record_set.columns,
+        "record_entries": problem.record_set.entries,
+        "pickup_deliveries": problem.pickup_deliveries,
+        "time_slices": problem.time_slices
+    }
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as f:
+        f.writestr("header.json", json.dumps(header, default = str)) # Time cells are stored as text
+
+        for name, column in columns.items():
+            f.writestr(name, memoryview(column).cast("B").tobytes())
+
+def read_snapshot(path):
+    with zipfile.ZipFile(path, "r") as f:
+        header = json.loads(f.read("header.json").decode("utf-8"))
+
+        if header["version"] != SNAPSHOT_VERSION:
+            raise ValueError("Unsupported snapshot version '{0}'.".format(header["version"]))
+
+        columns = {}
+
+        for name, typecode in header["columns"]:
+            column = array.array(typecode)
+            column.frombytes(f.read(name))
+            if header["byteorder"] != sys.byteorder: column.byteswap()
+            columns[name] = column
+
+    locations = geoservices.Locations(geoservices.LatLng(latitude, longitude) for latitude, longitude in zip(columns["latitudes"], columns["longitudes"]))
+    size = len(locations)
+
+    # Split the flattened windows per location
+    time_windows = []
+    offset = 0
+
+    for count in columns["window_counts"]:
+        time_windows.append(list(zip(columns["window_starts"][offset:offset + count], columns["window_ends"][offset:offset + count])))
+        offset = offset + count
+
+    time_slices = header["time_slices"]
+    matrices = [geoservices.DistanceTimeMatrix(size, columns["distances_{0}".format(i)], columns["times_{0}".format(i)]) for i in range(max(len(time_slices), 1))]
+    matrix = geoservices.TimeDependentMatrix(time_slices, matrices) if time_slices else matrices[0]
+
+    return Snapshot(
+        header["configuration"],
+        excel.RecordSet(header["record_columns"], header["record_entries"]),
+        locations,
+        matrix,
+        time_windows,
+        list(columns["service_times"]),
+        [None if penalty == NO_DROP_PENALTY else penalty for penalty in columns["drop_penalties"]],
+        [tuple(pair) for pair in header["pickup_deliveries"]],
+        time_slices)
@@ -0,0 +1,19 @@
+class Node(object):
+    __slots__ = ["index", "time"]
+
+    def __init__(self, index, time):
+        self.index = index # Stop id of the location, 0 is the start/end location
+        self.time = time
+
+class Vehicle(object):
+    __slots__ = ["nodes"]
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+class Solution(object):
+    __slots__ = ["vehicles", "dropped"]
+
+    def __init__(self, vehicles, dropped):
+        self.vehicles = vehicles
+        self.dropped = dropped # Stop ids of the locations that couldn't be visited
@@ -1,38 +1,48 @@
 from ortools.constraint_solver import pywrapcp
 from ortools.constraint_solver import routing_enums_pb2
 import logging
+import evaluation
+from solution import Node, Vehicle, Solution
 
 logger = logging.getLogger()
 
-class Node(object):
-    def __init__(self, location, time):
-        self.location = location
-        self.time = time
-
-class Vehicle(object):
-    def __init__(self, nodes):
-        self.nodes = nodes
-
-class Solution(object):
-    def __init__(self, vehicles):
-        self.vehicles = vehicles
+TIME_DEPENDENT_ITERATIONS = 2 # Number of solves used to refine the departure times in time dependent mode
 
 class Solver(object):
-    def __init__(self, start_location, locations, time_windows, service_time, num_vehicles, time_limit_ms):
+    # time_windows contains a list of (start, end) windows for every location.
+    # service_times and drop_penalties optionally contain a value for every location. A drop penalty of None means the location is mandatory.
+    # pickup_deliveries contains (pickup, delivery) pairs of indices in locations.
+    def __init__(self, start_location, locations, time_windows, service_time, num_vehicles, time_limit_ms, service_times = None, drop_penalties = None, pickup_deliveries = None):
         if (len(locations) == 0): raise ValueError("Argument 'locations' cannot be empty.")
         if (len(time_windows) != len(locations)): raise ValueError("A time windows must be specified for every location except the start/end location.")
         if (num_vehicles <= 0): raise ValueError("Argument 'num_vehicles' must be greater than 0.")
         if (time_limit_ms <= 0): raise ValueError("Argument 'time_limit_ms' must be greater than 0.")
+        if (service_times is not None and len(service_times) != len(locations)): raise ValueError("A service time must be specified for every location except the start/end location.")
+        if (drop_penalties is not None and len(drop_penalties) != len(locations)): raise ValueError("A drop penalty must be specified for every location except the start/end location.")
 
         self.locations = locations
         self.time_windows = time_windows
         self.num_vehicles = num_vehicles
         self.service_time = service_time
         self.time_limit_ms = time_limit_ms
+        self.service_times = service_times if service_times is not None else [service_time] * len(locations)
+        self.drop_penalties = drop_penalties if drop_penalties is not None else [None] * len(locations)
+        self.pickup_deliveries = pickup_deliveries or []
+        self.__travel_time_callback = None
+        self.__travel_distance_callback = None
+        self.__time_dependent_travel_time_callback = None
 
         # Add start location with time windows of 0.
         self.locations.insert(0, start_location)
-        self.time_windows.insert(0, (0, 0))
+        self.time_windows.insert(0, [(0, 0)])
+        self.service_times.insert(0, service_time)
+        self.drop_penalties.insert(0, None)
+
+        # The indices of the pickups and deliveries shift by one because of the start location.
+        self.pickup_deliveries = [(pickup + 1, delivery + 1) for pickup, delivery in self.pickup_deliveries]
+
+        # Start with the beginning of the time windows as arrival times. They are refined with every solve.
+        self.__arrival_times = [min(window[0] for window in windows) for windows in self.time_windows]
 
     @property 
     def travel_time_callback(self):
@@ -42,6 +52,15 @@ class Solver(object):
     def travel_time_callback(self, value):
         self.__travel_time_callback = value
 
+    # Callback taking (from_location, to_location, departure_time). When set, it is used instead of travel_time_callback.
+    @property 
+    def time_dependent_travel_time_callback(self):
+        return self.__time_dependent_travel_time_callback
+
+    @time_dependent_travel_time_callback.setter
+    def time_dependent_travel_time_callback(self, value):
+        self.__time_dependent_travel_time_callback = value
+
     @property 
     def travel_distance_callback(self):
         return self.__travel_distance_callback
@@ -55,7 +74,17 @@ class Solver(object):
         actual_from_node = self.locations[from_node]
         actual_to_node = self.locations[to_node]
 
-        return self.travel_time_callback(actual_from_node, actual_to_node) + self.service_time
+        if self.time_dependent_travel_time_callback:
+            departure_time = self.__get_estimated_departure_time(from_node, to_node)
+            return self.time_dependent_travel_time_callback(actual_from_node, actual_to_node, departure_time) + self.service_times[from_node]
+
+        return self.travel_time_callback(actual_from_node, actual_to_node) + self.service_times[from_node]
+
+    # The transit time of an arc can't depend on the cumul variable, so the departure time is estimated from the
+    # arrival times of the previous solve (or the start of the time windows initially).
+    def __get_estimated_departure_time(self, from_node, to_node):
+        if from_node == 0: return self.__arrival_times[to_node] # The departure from the depot is right before the first stop.
+        return self.__arrival_times[from_node] + self.service_times[from_node]
 
     def __total_distance_callback(self, from_node, to_node):
         actual_from_node = self.locations[from_node]
@@ -67,11 +96,27 @@ class Solver(object):
         time = self.__total_time_callback(from_node, to_node)
         dist = self.__total_distance_callback(from_node, to_node)
 
-        return int((52.4 * dist * time) / 1000)  # Assumes an average speed of 70 kph (= 52.4 seconds per km)
+        return evaluation.arc_cost(dist, time)
     
     def solve(self):
         logger.info("Calculating solution.")
 
+        if not self.time_dependent_travel_time_callback:
+            return self.__solve(self.time_limit_ms)
+
+        solution = None
+
+        for i in range(TIME_DEPENDENT_ITERATIONS):
+            logger.info("Time dependent iteration {0}.".format(i + 1))
+
+            iteration_solution = self.__solve(self.time_limit_ms // TIME_DEPENDENT_ITERATIONS)
+            if not iteration_solution: break
+
+            solution = iteration_solution
+
+        return solution
+
+    def __solve(self, time_limit_ms):
         depot = 0
         num_locations = len(self.locations)
 
@@ -80,7 +125,7 @@ class Solver(object):
 
         # Set heuristics and time limit
         search_parameters.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
-        search_parameters.time_limit_ms = self.time_limit_ms
+        search_parameters.time_limit_ms = time_limit_ms
 
         # Try to minimize the amount of vehicles
         node_indices = []
@@ -88,7 +133,7 @@ class Solver(object):
             node_indices.append(routing.IndexToNode(i))
 
         # Add additional cost for each vehicle.
-        routing.AddSoftSameVehicleConstraint(node_indices, 100000)
+        routing.AddSoftSameVehicleConstraint(node_indices, evaluation.VEHICLE_COST)
 
         #  Set cost function. We use total distance.
         cost_function = self.__cost_function
@@ -107,16 +152,36 @@ class Solver(object):
                              time_fix_start_cumul_to_zero_time,
                              time)
 
-        # Add time window constraints.
+        # Add time window constraints. Gaps between multiple windows of a location are removed from its domain.
         time_dimension = routing.GetDimensionOrDie(time)
 
         for location in range(1, num_locations):
-            start = self.time_windows[location][0]
-            end = self.time_windows[location][1]
-            time_dimension.CumulVar(location).SetRange(start, end)
+            windows = sorted(self.time_windows[location])
+            cumul_var = time_dimension.CumulVar(routing.NodeToIndex(location))
+            cumul_var.SetRange(windows[0][0], windows[-1][1])
+
+            for previous, current in zip(windows, windows[1:]):
+                if current[0] - previous[1] > 1:
+                    cumul_var.RemoveInterval(previous[1] + 1, current[0] - 1)
+
+        # Every location may be dropped, so infeasible locations still result in a (partial) solution.
+        for location in range(1, num_locations):
+            routing.AddDisjunction([location], evaluation.get_drop_penalty(self.drop_penalties[location]))
+
+        # A pickup must be visited by the same vehicle, before the delivery.
+        constraint_solver = routing.solver()
+
+        for pickup, delivery in self.pickup_deliveries:
+            pickup_index = routing.NodeToIndex(pickup)
+            delivery_index = routing.NodeToIndex(delivery)
+
+            routing.AddPickupAndDelivery(pickup, delivery)
+            constraint_solver.Add(routing.ActiveVar(pickup_index) == routing.ActiveVar(delivery_index))
+            constraint_solver.Add(routing.VehicleVar(pickup_index) == routing.VehicleVar(delivery_index))
+            constraint_solver.Add(time_dimension.CumulVar(pickup_index) <= time_dimension.CumulVar(delivery_index))
 
         # Set a cost coefficient on time. This should minimize "idle" time of vehicles.
-        time_dimension.SetSpanCostCoefficientForAllVehicles(2)
+        time_dimension.SetSpanCostCoefficientForAllVehicles(evaluation.SPAN_COST_COEFFICIENT)
 
         # Solve the problem.
         assignment = routing.SolveWithParameters(search_parameters)
@@ -137,14 +202,24 @@ class Solver(object):
             while not routing.IsEnd(index):
                 node_index = routing.IndexToNode(index)
                 time_var = time_dimension.CumulVar(index)
-                nodes.append(Node(self.locations[node_index], assignment.Value(time_var)))
+                nodes.append(Node(node_index, assignment.Value(time_var)))
                 index = assignment.Value(routing.NextVar(index))
 
+                if node_index != depot: self.__arrival_times[node_index] = assignment.Value(time_var)
+
             node_index = routing.IndexToNode(index)
             time_var = time_dimension.CumulVar(index)
-            nodes.append(Node(self.locations[node_index], assignment.Value(time_var)))
+            nodes.append(Node(node_index, assignment.Value(time_var)))
 
             if len(nodes) > 2: # 2 is from start to finish directly
                 vehicles.append(Vehicle(nodes))
 
-        return Solution(vehicles)
+        # Locations that are not visited by any vehicle were dropped
+        dropped = []
+
+        for location in range(1, num_locations):
+            index = routing.NodeToIndex(location)
+            if assignment.Value(routing.NextVar(index)) == index:
+                dropped.append(location)
+
+        return Solution(vehicles, dropped)
@@ -1,4 +1,9 @@
-import dateutil.parser
+import datetime
+import functools
+import re
+
+# Matches the common formats (e.g. "8:30", "08:30:00", "8:30 PM", "1899-12-30 08:30:00") without going through dateutil.
+TIME_PATTERN = re.compile(r"^\s*(?:\d{4}-\d{2}-\d{2}[ T])?(\d{1,2})[:.](\d{2})(?::(\d{2}))?(?:\.\d+)?\s*([AaPp][Mm])?\s*$")
 
 def split_in_batches(lst, batch_size):
     for i in range(0, len(lst), batch_size):
@@ -7,10 +12,36 @@ def split_in_batches(lst, batch_size):
 def time_to_seconds(time):
     return (time.hour * 60 + time.minute) * 60 + time.second
 
+@functools.lru_cache(maxsize = 1024)
+def _parse_time_string(value):
+    match = TIME_PATTERN.match(value)
+
+    if not match:
+        # Slow path for anything exotic. dateutil is only loaded when it's needed.
+        import dateutil.parser
+
+        try:
+            return dateutil.parser.parse(value).time()
+        except OverflowError:
+            raise ValueError("Invalid time '{0}'.".format(value))
+
+    hour = int(match.group(1))
+    minute = int(match.group(2))
+    second = int(match.group(3) or 0)
+    suffix = match.group(4)
+
+    if suffix:
+        if hour < 1 or hour > 12: raise ValueError("Invalid hour '{0}'.".format(hour))
+        hour = hour % 12 + (12 if suffix.lower() == "pm" else 0)
+
+    return datetime.time(hour, minute, second)
+
 def parse_time(value):
-    if isinstance(value, str):
-        return dateutil.parser.parse(value).time()
+    if isinstance(value, datetime.time):
+        return value
     elif isinstance(value, datetime.datetime):
         return value.time()
+    elif isinstance(value, str):
+        return _parse_time_string(value)
     else:
         raise ValueError("Value is in an invalid format.")
@@ -5,8 +5,15 @@ from tkinter import messagebox
 from tkinter.scrolledtext import ScrolledText
 import queue
 import threading
+import time
+import logging
 from datetime import datetime
-import dateutil.parser
+import datahelpers
+
+NOTIFICATION_INTERVAL_MS = 100 # Polling interval when the queue is idle
+NOTIFICATION_BUDGET_SECONDS = 0.05 # Maximum time spent draining the queue per tick
+MAX_LOG_LINES = 5000 # Older lines are discarded from the output
+LOG_LEVELS = ["INFO", "WARNING", "ERROR"]
 
 class NotificationType(enum.Enum):
     SHOW_MESSAGE = 1
@@ -66,7 +73,7 @@ class MainWindow(Tk):
 
         # Start listening for notifications
         self.notify_queue = notify_queue
-        self.after(100, self.__handle_notifications)
+        self.after(NOTIFICATION_INTERVAL_MS, self.__handle_notifications)
 
     def __create_optimize_tab(self, optimize_tab):
         optimize_pane = PanedWindow(optimize_tab)
@@ -99,6 +106,12 @@ class MainWindow(Tk):
         lbl_output = Label(optimize_pane, text = "Output:")
         lbl_output.grid(row = 5, column = 0, sticky = W, pady = 5)
 
+        self.__log_level = StringVar()
+        self.__log_level.set("INFO")
+
+        cmb_log_level = Combobox(optimize_pane, textvariable = self.__log_level, values = LOG_LEVELS, state = "readonly", width = 10)
+        cmb_log_level.grid(row = 5, column = 1, sticky = E, pady = 5)
+
         frame2 = Frame(optimize_pane)
         scrollbar = Scrollbar(frame2) 
         self.__logArea = Text(frame2, state = DISABLED, yscrollcommand = scrollbar.set, borderwidth = 0, highlightthickness = 0)
@@ -170,8 +183,38 @@ class MainWindow(Tk):
         txt_start_addr = Entry(options_pane, textvariable = self.__start_address)
         txt_start_addr.grid(row = 4, column = 1, sticky = W+E)
 
+        self.__traffic_slices = StringVar()
+        self.__traffic_slices.set(
+            self.configuration["traffic_slices"] if "traffic_slices" in self.configuration else ""
+        )
+
+        lbl_traffic_slices = Label(options_pane, text = "Traffic slices (optional):")
+        lbl_traffic_slices.grid(row = 5, column = 0, sticky = W)
+        txt_traffic_slices = Entry(options_pane, textvariable = self.__traffic_slices)
+        txt_traffic_slices.grid(row = 5, column = 1, sticky = W+E)
+
+        self.__google_daily_quota = StringVar()
+        self.__google_daily_quota.set(
+            self.configuration["google_daily_quota"] if "google_daily_quota" in self.configuration else ""
+        )
+
+        lbl_google_quota = Label(options_pane, text = "Google daily quota (optional):")
+        lbl_google_quota.grid(row = 6, column = 0, sticky = W)
+        txt_google_quota = Entry(options_pane, textvariable = self.__google_daily_quota)
+        txt_google_quota.grid(row = 6, column = 1, sticky = W+E)
+
+        self.__bing_daily_quota = StringVar()
+        self.__bing_daily_quota.set(
+            self.configuration["bing_daily_quota"] if "bing_daily_quota" in self.configuration else ""
+        )
+
+        lbl_bing_quota = Label(options_pane, text = "Bing daily quota (optional):")
+        lbl_bing_quota.grid(row = 7, column = 0, sticky = W)
+        txt_bing_quota = Entry(options_pane, textvariable = self.__bing_daily_quota)
+        txt_bing_quota.grid(row = 7, column = 1, sticky = W+E)
+
         btn_save = Button(options_pane, text = "Save", command = self.__handle_save_options)
-        btn_save.grid(row = 5, column = 0, columnspan = 2, pady = 10)
+        btn_save.grid(row = 8, column = 0, columnspan = 2, pady = 10)
 
     def __select_source(self):
         source_file = filedialog.askopenfilename(initialdir = "/", title = "Select file", filetypes = [("Microsoft Office Excel Worksheet", "*.xlsx")])
@@ -209,7 +252,10 @@ class MainWindow(Tk):
             "google_api_key": self.__google_api_key.get(),
             "bing_api_key": self.__bing_api_key.get(),
             "service_time": int(self.__service_time.get()),
-            "start_address": self.__start_address.get()
+            "start_address": self.__start_address.get(),
+            "traffic_slices": self.__traffic_slices.get(),
+            "google_daily_quota": self.__google_daily_quota.get().strip(),
+            "bing_daily_quota": self.__bing_daily_quota.get().strip()
         }
 
     def __validate_options(self):
@@ -224,6 +270,17 @@ class MainWindow(Tk):
         except ValueError:
             return "'Service time' must be a whole number."
 
+        try:
+            datahelpers.get_time_slices(self.__traffic_slices.get())
+        except ValueError:
+            return "'Traffic slices' must be a comma separated list of times (e.g. 7:00, 9:00, 16:00)."
+
+        try:
+            if self.__google_daily_quota.get().strip(): int(self.__google_daily_quota.get())
+            if self.__bing_daily_quota.get().strip(): int(self.__bing_daily_quota.get())
+        except ValueError:
+            return "The daily quotas must be whole numbers."
+
         return None
 
     def __validate_calculate(self):
@@ -243,21 +300,37 @@ class MainWindow(Tk):
         return result
 
     def __handle_notifications(self):
-        try:
-            for i in range(5):
+        deadline = time.monotonic() + NOTIFICATION_BUDGET_SECONDS
+        pending_logs = []
+        exhausted = False
+
+        # Drain everything that is pending, but don't block the UI for longer than the budget.
+        while time.monotonic() < deadline:
+            try:
                 result = self.notify_queue.get(0)
-                notification_type = result["type"]
-
-                if notification_type == NotificationType.SHOW_MESSAGE:
-                    self.__show_message(result)
-                elif notification_type == NotificationType.EMIT_LOG:
-                    self.__emit_log(result)
-                elif notification_type == NotificationType.DONE:
-                    self.__done()
-        except queue.Empty:
-            pass
-                
-        self.after(100, self.__handle_notifications)
+            except queue.Empty:
+                exhausted = True
+                break
+
+            notification_type = result["type"]
+
+            if notification_type == NotificationType.EMIT_LOG:
+                pending_logs.append(result)
+                continue
+
+            # Flush the logs first, so they appear before the message box blocks.
+            self.__emit_logs(pending_logs)
+            pending_logs = []
+
+            if notification_type == NotificationType.SHOW_MESSAGE:
+                self.__show_message(result)
+            elif notification_type == NotificationType.DONE:
+                self.__done()
+
+        self.__emit_logs(pending_logs)
+
+        # If messages are still waiting, come back as soon as the UI has had the chance to update.
+        self.after(NOTIFICATION_INTERVAL_MS if exhausted else 1, self.__handle_notifications)
 
     def __done(self):
         self.__btn_calculate.config(state = NORMAL) # Enable calculate button
@@ -273,8 +346,32 @@ class MainWindow(Tk):
         elif level == MessageLevel.ERROR:
             messagebox.showerror(title, body)
 
-    def __emit_log(self, data):
+    def __emit_logs(self, logs):
+        minimum_level = logging.getLevelName(self.__log_level.get())
+        logs = [log for log in logs if logging.getLevelName(log["level"]) >= minimum_level]
+
+        if not logs: return
+
         self.__logArea.configure(state = NORMAL)
-        self.__logArea.insert(END, data["message"] + "\n", data["level"])
+
+        # Coalesce consecutive lines with the same level into a single insert.
+        lines = []
+        level = logs[0]["level"]
+
+        for log in logs:
+            if log["level"] != level:
+                self.__logArea.insert(END, "".join(lines), level)
+                lines = []
+                level = log["level"]
+
+            lines.append(log["message"] + "\n")
+
+        self.__logArea.insert(END, "".join(lines), level)
+
+        # Limit the scrollback
+        line_count = int(self.__logArea.index("end-1c").split(".")[0]) - 1
+        if line_count > MAX_LOG_LINES:
+            self.__logArea.delete("1.0", "{0}.0".format(line_count - MAX_LOG_LINES + 1))
+
         self.__logArea.see(END)
         self.__logArea.configure(state = DISABLED)